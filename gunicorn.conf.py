@@ -0,0 +1,17 @@
+"""
+Configuração do Gunicorn para servir o nó da blockchain em produção
+(`gunicorn node_server:app`), no lugar do servidor de desenvolvimento
+do Flask, que atende uma requisição por vez.
+
+A cadeia, os pares e as transações pendentes vivem na memória do
+processo, então o nó precisa rodar com UM único worker; a concorrência
+vem das threads, que atendem bem a carga dominada por I/O de rede
+(consenso e anúncio de blocos a outros nós).
+"""
+
+bind = "127.0.0.1:8000"
+worker_class = "gthread"
+workers = 1
+threads = 8
+keepalive = 30
+timeout = 120
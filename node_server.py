@@ -1,24 +1,130 @@
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
 import json
+import threading
 import time
 
-from flask import Flask, request
+from flask import Flask, Response, request
 import requests
 
+# orjson (JSON em C) acelera a serialização das respostas e do tráfego
+# entre nós; se não estiver instalado, cai no json da stdlib. O hash dos
+# blocos continua usando json.dumps(sort_keys=True) para não mudar a
+# representação canônica.
+try:
+    import orjson
+
+    def _dumps(data):
+        return orjson.dumps(data)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(data):
+        return json.dumps(data).encode()
+
+    _loads = json.loads
+
+# msgpack é opcional: quando instalado, os blocos anunciados entre nós
+# trafegam em binário (payload menor e parsing em C). Nós sem msgpack
+# continuam anunciando e aceitando blocos em JSON.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Tempo limite (em segundos) das requisições feitas a outros nós.
+REQUEST_TIMEOUT = 5
+
+# Sessão HTTP compartilhada entre as chamadas a outros nós: reaproveita
+# conexões TCP (keep-alive) em vez de abrir e fechar uma a cada requisição.
+session = requests.Session()
+session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=32,
+                                                       pool_maxsize=32))
+
+
+def _merkle_root(transactions):
+    """
+    Calcula a raiz de Merkle das transações: cada transação vira uma
+    folha sha256 e os níveis são combinados aos pares até sobrar um
+    único digest. Assim as transações ficam resumidas em 32 bytes e o
+    hash do bloco pode cobrir só o cabeçalho, de tamanho fixo.
+    """
+    if not transactions:
+        return sha256(b'').hexdigest()
+
+    level = [sha256(json.dumps(tx, sort_keys=True).encode()).digest()
+             for tx in transactions]
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [sha256(level[i] + level[i + 1]).digest()
+                 for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
+def _mine_nonce(midstate, tail_bytes, zero_prefix, odd_nibble):
+    """
+    Laço interno de mineração: testa nonces sequenciais sobre o
+    midstate até achar um digest que satisfaça a dificuldade e
+    retorna (nonce, hash hexadecimal). Função isolada, só com
+    variáveis locais, para minimizar o custo do interpretador
+    por tentativa.
+    """
+    copy = midstate.copy
+    nonce = 0
+    while True:
+        hasher = copy()
+        hasher.update(str(nonce).encode() + tail_bytes)
+        digest = hasher.digest()
+        if digest.startswith(zero_prefix) and \
+                (not odd_nibble or digest[len(zero_prefix)] < 0x10):
+            return nonce, hasher.hexdigest()
+        nonce += 1
+
 
 class Block:
+    # Armazenamento fixo de atributos: um nó de vida longa acumula
+    # milhares de blocos e o __dict__ por instância custa memória e
+    # indireção desnecessárias.
+    __slots__ = ('index', 'transactions', 'timestamp', 'previous_hash',
+                 'nonce', 'merkle_root', 'hash')
+
     def __init__(self, index, transactions, timestamp, previous_hash, nonce=0):
         self.index = index
-        self.transactions = transactions
+        # Tupla imutável: o conteúdo não muda depois que o bloco é
+        # criado e a raiz de Merkle abaixo depende dele.
+        self.transactions = tuple(transactions)
         self.timestamp = timestamp
         self.previous_hash = previous_hash
         self.nonce = nonce
+        self.merkle_root = _merkle_root(self.transactions)
+
+    def to_dict(self):
+        """
+        Retorna os campos do bloco como dicionário (incluindo o hash,
+        se já calculado), no formato usado nas respostas da API e no
+        anúncio entre nós.
+        """
+        return {slot: getattr(self, slot) for slot in self.__slots__
+                if hasattr(self, slot)}
+
+    def _header(self):
+        """
+        Campos do cabeçalho que entram no hash do bloco. As transações
+        são representadas pela raiz de Merkle, então o tamanho do que é
+        hasheado não cresce com o número de transações.
+        """
+        return {"index": self.index,
+                "merkle_root": self.merkle_root,
+                "nonce": self.nonce,
+                "previous_hash": self.previous_hash,
+                "timestamp": self.timestamp}
 
     def compute_hash(self):
         """
         Função que retorna o hash do bloco
         """
-        block_string = json.dumps(self.__dict__, sort_keys=True)
+        block_string = json.dumps(self._header(), sort_keys=True)
         return sha256(block_string.encode()).hexdigest()
 
 
@@ -26,9 +132,28 @@ class Blockchain:
     # Seta o critério de dificuldade do algoritmo de PoW
     difficulty = 2
 
+    # Prefixo de zeros (em bytes) equivalente à dificuldade,
+    # pré-calculado para não ser reconstruído a cada verificação.
+    # Alterações de dificuldade devem passar por 'set_difficulty'.
+    _zero_prefix = b'\x00' * (difficulty // 2)
+
+    @classmethod
+    def set_difficulty(cls, difficulty):
+        """
+        Ajusta o critério de dificuldade e refaz o prefixo de zeros
+        pré-calculado usado nas verificações de hash.
+        """
+        cls.difficulty = difficulty
+        cls._zero_prefix = b'\x00' * (difficulty // 2)
+
     def __init__(self):
         self.unconfirmed_transactions = []
         self.chain = []
+        # Protegem o estado mutável quando o nó roda com várias
+        # threads: um lock para a lista de transações pendentes e
+        # outro para a cadeia em si.
+        self._tx_lock = threading.Lock()
+        self._chain_lock = threading.RLock()
 
     def create_genesis_block(self):
         """
@@ -50,17 +175,18 @@ class Blockchain:
         * Se a PoW é válida.
         * Se o previous_hash referenciado condiz com o hash do último bloco inserido.
         """
-        previous_hash = self.last_block.hash
+        with self._chain_lock:
+            previous_hash = self.last_block.hash
 
-        if previous_hash != block.previous_hash:
-            return False
+            if previous_hash != block.previous_hash:
+                return False
 
-        if not Blockchain.is_valid_proof(block, proof):
-            return False
+            if not Blockchain.is_valid_proof(block, proof):
+                return False
 
-        block.hash = proof
-        self.chain.append(block)
-        return True
+            block.hash = proof
+            self.chain.append(block)
+            return True
 
     @staticmethod
     def proof_of_work(block):
@@ -70,15 +196,41 @@ class Blockchain:
         """
         block.nonce = 0
 
-        computed_hash = block.compute_hash()
-        while not computed_hash.startswith('0' * Blockchain.difficulty):
-            block.nonce += 1
-            computed_hash = block.compute_hash()
-
+        # Serializa o cabeçalho uma única vez: entre as tentativas só o
+        # nonce muda, então o JSON é dividido em cabeça e cauda ao redor
+        # do valor do nonce. O estado do sha256 já alimentado com a
+        # cabeça (midstate) é clonado a cada iteração, evitando refazer
+        # o json.dumps e re-absorver o prefixo inteiro por tentativa.
+        # O sha256 do hashlib já usa a implementação nativa do OpenSSL
+        # (com extensões SHA da CPU quando disponíveis).
+        block_string = json.dumps(block._header(), sort_keys=True)
+        head, _, tail = block_string.partition('"nonce": 0')
+        midstate = sha256((head + '"nonce": ').encode())
+        tail_bytes = tail.encode()
+
+        # Compara os bytes crus do digest em vez de gerar o hexdigest
+        # (string de 64 caracteres) a cada tentativa: a conversão para
+        # hexadecimal só acontece uma vez, no hash vencedor.
+        block.nonce, computed_hash = _mine_nonce(midstate, tail_bytes,
+                                                 Blockchain._zero_prefix,
+                                                 Blockchain.difficulty % 2)
         return computed_hash
 
     def add_new_transaction(self, transaction):
-        self.unconfirmed_transactions.append(transaction)
+        with self._tx_lock:
+            self.unconfirmed_transactions.append(transaction)
+
+    @staticmethod
+    def _meets_difficulty(digest):
+        """
+        Verifica sobre os bytes crus do digest se o hash começa com a
+        quantidade de zeros hexadecimais exigida pela dificuldade.
+        """
+        zero_prefix = Blockchain._zero_prefix
+        if not digest.startswith(zero_prefix):
+            return False
+        return (Blockchain.difficulty % 2 == 0 or
+                digest[len(zero_prefix)] < 0x10)
 
     @classmethod
     def is_valid_proof(cls, block, block_hash):
@@ -86,25 +238,33 @@ class Blockchain:
         Verifica se o blosk_hash é um hash válido e se satisfaz
         o critério de dificuldade.
         """
-        return (block_hash.startswith('0' * Blockchain.difficulty) and
-                block_hash == block.compute_hash())
+        return (block_hash == block.compute_hash() and
+                cls._meets_difficulty(bytes.fromhex(block_hash)))
 
     @classmethod
     def check_chain_validity(cls, chain):
+        """
+        Valida uma cadeia completa de blocos: o encadeamento dos hashes
+        e a prova de trabalho de cada bloco. O bloco originário não é
+        minerado, então para ele só se confere o próprio hash, sem o
+        critério de dificuldade.
+        """
         result = True
         previous_hash = "0"
 
         for block in chain:
-            block_hash = block.hash
-            # Remove os campos de hash para recalcula-los usando o método 'compute_hash'.
-            delattr(block, "hash")
-
-            if not cls.is_valid_proof(block, block_hash) or \
-                    previous_hash != block.previous_hash:
+            # Compara com o hash armazenado sem alterar o bloco:
+            # 'compute_hash' já deixa o campo 'hash' de fora.
+            if block.index == 0:
+                valid = block.hash == block.compute_hash()
+            else:
+                valid = cls.is_valid_proof(block, block.hash)
+
+            if not valid or previous_hash != block.previous_hash:
                 result = False
                 break
 
-            block.hash, previous_hash = block_hash, block_hash
+            previous_hash = block.hash
 
         return result
 
@@ -114,20 +274,32 @@ class Blockchain:
         pendente na blockchain, adicionando ela no bloco e descobrido
         sua Proof of Work.
         """
-        if not self.unconfirmed_transactions:
+        # Retira as transações pendentes de forma atômica: transações
+        # que chegarem durante a mineração entram na próxima leva em
+        # vez de serem perdidas ao limpar a lista no final.
+        with self._tx_lock:
+            transactions = self.unconfirmed_transactions
+            self.unconfirmed_transactions = []
+
+        if not transactions:
             return False
 
         last_block = self.last_block
 
         new_block = Block(index=last_block.index + 1,
-                          transactions=self.unconfirmed_transactions,
+                          transactions=transactions,
                           timestamp=time.time(),
                           previous_hash=last_block.hash)
 
         proof = self.proof_of_work(new_block)
-        self.add_block(new_block, proof)
 
-        self.unconfirmed_transactions = []
+        if not self.add_block(new_block, proof):
+            # Outro bloco entrou na cadeia durante a mineração;
+            # devolve as transações para a próxima tentativa.
+            with self._tx_lock:
+                self.unconfirmed_transactions = \
+                    transactions + self.unconfirmed_transactions
+            return False
 
         return True
 
@@ -141,16 +313,30 @@ blockchain.create_genesis_block()
 # endereço para outros membros participantes da rede
 peers = set()
 
+# Protege o conjunto de pares contra alterações concorrentes.
+peers_lock = threading.Lock()
+
+# Serializa a substituição do blockchain global: ler o global, montar a
+# candidata, comparar e trocar precisa ser atômico, senão duas rodadas
+# concorrentes podem desfazer a adoção uma da outra.
+adoption_lock = threading.Lock()
+
+
+# Campos obrigatórios de uma transação, montados uma única vez em vez
+# de reconstruir a lista a cada requisição.
+REQUIRED_TX_FIELDS = ("author", "content")
+
 
 # endpoint de envio de nova transação
 @app.route('/new_transaction', methods=['POST'])
 def new_transaction():
-    tx_data = request.get_json()
-    required_fields = ["author", "content"]
+    try:
+        tx_data = _loads(request.get_data())
+    except ValueError:
+        return "Dados de transação inválidos", 400
 
-    for field in required_fields:
-        if not tx_data.get(field):
-            return "Dados de transação inválidos", 404
+    if not all(tx_data.get(field) for field in REQUIRED_TX_FIELDS):
+        return "Dados de transação inválidos", 404
 
     tx_data["timestamp"] = time.time()
 
@@ -162,12 +348,30 @@ def new_transaction():
 # endpoint que retorna todos os blocos na cadeia
 @app.route('/chain', methods=['GET'])
 def get_chain():
-    chain_data = []
-    for block in blockchain.chain:
-        chain_data.append(block.__dict__)
-    return json.dumps({"length": len(chain_data),
-                       "chain": chain_data,
-                       "peers": list(peers)})
+    # Gera a resposta por partes, bloco a bloco, em vez de montar a
+    # lista inteira e serializá-la de uma vez: o uso de memória fica
+    # constante e o primeiro byte sai mais cedo em cadeias longas.
+    chain = blockchain.chain
+    with peers_lock:
+        peers_snapshot = list(peers)
+
+    def generate():
+        yield b'{"length": ' + str(len(chain)).encode() + b', "chain": ['
+        for idx, block in enumerate(chain):
+            if idx:
+                yield b','
+            yield _dumps(block.to_dict())
+        yield b'], "peers": ' + _dumps(peers_snapshot) + b'}'
+
+    return Response(generate(), mimetype='application/json')
+
+
+# endpoint com o resumo da cadeia (tamanho e hash da ponta), usado no
+# consenso para filtrar pares sem baixar a cadeia inteira
+@app.route('/chain_head', methods=['GET'])
+def get_chain_head():
+    return _dumps({"length": len(blockchain.chain),
+                   "tip": blockchain.last_block.hash})
 
 
 # endpoint para iniciar mineiração de transações ainda não confirmadas (se existir).
@@ -189,12 +393,16 @@ def mine_unconfirmed_transactions():
 # endpoint para adicionar novos pares à rede
 @app.route('/register_node', methods=['POST'])
 def register_new_peers():
-    node_address = request.get_json()["node_address"]
+    try:
+        node_address = _loads(request.get_data())["node_address"]
+    except (ValueError, KeyError):
+        return "Dados inválidos", 400
     if not node_address:
         return "Dados inválidos", 400
 
     # Adiciona o nó para a lista de pares
-    peers.add(node_address)
+    with peers_lock:
+        peers.add(node_address)
 
     # Retorna a função get_chain() para sincronizar a cadeia
     return get_chain()
@@ -207,7 +415,10 @@ def register_with_existing_node():
     para registrar o nó atual com o nó especificado 
     no request e sincronizar o blockchain.
     """
-    node_address = request.get_json()["node_address"]
+    try:
+        node_address = _loads(request.get_data())["node_address"]
+    except (ValueError, KeyError):
+        return "Dados inválidos", 400
     if not node_address:
         return "Dados inválidos", 400
 
@@ -215,16 +426,20 @@ def register_with_existing_node():
     headers = {'Content-Type': "application/json"}
 
     # Request para obter informações do nó
-    response = requests.post(node_address + "/register_node",
-                             data=json.dumps(data), headers=headers)
+    response = session.post(node_address + "/register_node",
+                            data=_dumps(data), headers=headers,
+                            timeout=REQUEST_TIMEOUT)
 
     if response.status_code == 200:
         global blockchain
         global peers
-        # atualiza a cadeia e os pares
-        chain_dump = response.json()['chain']
-        blockchain = create_chain_from_dump(chain_dump)
-        peers.update(response.json()['peers'])
+        # atualiza a cadeia e os pares (um único parse da resposta)
+        data = response.json()
+        new_chain = create_chain_from_dump(data['chain'])
+        with adoption_lock:
+            blockchain = new_chain
+        with peers_lock:
+            peers.update(data['peers'])
         return "Registro bem sucedido", 200
     else:
         # se algo der errado, repassa a resposta da API
@@ -252,7 +467,20 @@ def create_chain_from_dump(chain_dump):
 # endpoint para adicionar bloco mineirado.
 @app.route('/add_block', methods=['POST'])
 def verify_and_add_block():
-    block_data = request.get_json()
+    if request.content_type == "application/msgpack":
+        if msgpack is None:
+            # Este nó não tem msgpack instalado; avisa o remetente em
+            # vez de tentar (e falhar) o parse como JSON.
+            return "Formato não suportado por este nó", 415
+        try:
+            block_data = msgpack.unpackb(request.get_data(), raw=False)
+        except ValueError:
+            return "Corpo do bloco inválido", 400
+    else:
+        try:
+            block_data = _loads(request.get_data())
+        except ValueError:
+            return "Corpo do bloco inválido", 400
     block = Block(block_data["index"],
                   block_data["transactions"],
                   block_data["timestamp"],
@@ -271,41 +499,189 @@ def verify_and_add_block():
 # endpoint para recuperar as transações pendentes
 @app.route('/pending_tx')
 def get_pending_tx():
-    return json.dumps(blockchain.unconfirmed_transactions)
+    return _dumps(blockchain.unconfirmed_transactions)
 
 
-def consensus():
+def _fetch_head(node):
     """
-    Função que atualiza a cadeia presente 
-    caso uma cadeia maior válida for achada.
+    Consulta o resumo da cadeia de um par; retorna None se o par não
+    responder ou não expuser o endpoint.
+    """
+    try:
+        response = session.get('{}chain_head'.format(node),
+                               timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            return None
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+
+def _fetch_chain(node):
+    """
+    Busca a cadeia de um par; retorna None se o par não responder.
+    """
+    try:
+        return session.get('{}chain'.format(node), timeout=REQUEST_TIMEOUT)
+    except requests.exceptions.RequestException:
+        return None
+
+
+def _adopt_chain(chain_dump):
+    """
+    Tenta adotar uma cadeia recebida de um par. O prefixo em comum com a
+    cadeia local já foi validado quando entrou nela, então só os blocos
+    a partir do ponto de divergência são reconstruídos e verificados
+    (PoW e encadeamento) via `add_block`, em vez de revalidar a cadeia
+    inteira a cada rodada de consenso.
     """
     global blockchain
 
-    longest_chain = None
-    current_len = len(blockchain.chain)
+    # O lock de adoção impede que outra rodada troque o global no meio
+    # do processo; o lock da cadeia congela a cadeia atual enquanto a
+    # candidata é montada, para que blocos não entrem nela no meio da
+    # comparação.
+    with adoption_lock, blockchain._chain_lock:
+        current = blockchain
+        # Acha o ponto de divergência comparando os hashes já conhecidos.
+        fork = 0
+        for local_block, block_data in zip(current.chain, chain_dump):
+            if local_block.hash != block_data.get("hash"):
+                break
+            fork += 1
 
-    for node in peers:
-        response = requests.get('{}chain'.format(node))
-        length = response.json()['length']
-        chain = response.json()['chain']
-        if length > current_len and blockchain.check_chain_validity(chain):
-            current_len = length
-            longest_chain = chain
+        if fork == 0:
+            # Nem o bloco originário coincide: cadeia de outra rede.
+            return False
+
+        candidate = Blockchain()
+        candidate.chain = current.chain[:fork]
+        for block_data in chain_dump[fork:]:
+            block = Block(block_data["index"],
+                          block_data["transactions"],
+                          block_data["timestamp"],
+                          block_data["previous_hash"],
+                          block_data["nonce"])
+            if not candidate.add_block(block, block_data["hash"]):
+                return False
+
+        # Só troca pela candidata se ela for de fato mais longa que a
+        # cadeia local. O tamanho vem do dump recebido e é conferido
+        # dentro do lock, nunca do campo 'length' reportado pelo par —
+        # um par mentindo no 'length' poderia encolher a cadeia local.
+        if len(candidate.chain) <= len(current.chain):
+            return False
 
-    if longest_chain:
-        blockchain = longest_chain
+        # Leva as transações ainda não mineradas para a nova cadeia:
+        # trocar de cadeia não pode descartar o que está pendente.
+        with current._tx_lock:
+            pending = current.unconfirmed_transactions
+            current.unconfirmed_transactions = []
+        candidate.unconfirmed_transactions = pending
+
+        blockchain = candidate
         return True
 
-    return False
+
+def consensus():
+    """
+    Função que atualiza a cadeia presente
+    caso uma cadeia maior válida for achada.
+    """
+    updated = False
+    current_len = len(blockchain.chain)
+
+    with peers_lock:
+        nodes = list(peers)
+
+    if not nodes:
+        return False
+
+    # Primeiro consulta em paralelo só o resumo da cadeia de cada par
+    # (tamanho e hash da ponta): a cadeia completa só é baixada dos
+    # pares que afirmam ter uma cadeia maior que a local.
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        heads = list(executor.map(_fetch_head, nodes))
+
+    candidates = []
+    for node, head in zip(nodes, heads):
+        if head is None:
+            # Par sem /chain_head: baixa a cadeia completa como antes.
+            candidates.append((0, node))
+        elif head.get('length', 0) > current_len:
+            candidates.append((head['length'], node))
+
+    # Tenta primeiro quem anuncia a cadeia mais longa.
+    candidates.sort(key=lambda item: item[0], reverse=True)
+
+    for announced, node in candidates:
+        # Depois de uma adoção, pares cujo resumo já não supera a
+        # cadeia atual nem chegam a ser baixados. Pares sem /chain_head
+        # (announced == 0) continuam tendo a cadeia completa consultada.
+        if announced and announced <= current_len:
+            continue
+        response = _fetch_chain(node)
+        if response is None:
+            continue
+        # Faz o parse do corpo uma única vez por par. Uma resposta
+        # malformada desclassifica o par sem derrubar a rodada inteira.
+        try:
+            data = response.json()
+            length = data['length']
+            chain = data['chain']
+        except (ValueError, KeyError):
+            continue
+        if length > current_len and _adopt_chain(chain):
+            # O tamanho reportado serve só de filtro; o novo tamanho
+            # real vem da cadeia efetivamente adotada.
+            current_len = len(blockchain.chain)
+            updated = True
+
+    return updated
+
+
+def _post_block(peer, data, headers, json_fallback=None):
+    """
+    Envia um bloco serializado para um par, ignorando pares fora do ar.
+    Se o par recusar o formato (415 para msgpack), reenvia o mesmo
+    bloco em JSON para que o anúncio não se perca.
+    """
+    url = "{}add_block".format(peer)
+    try:
+        response = session.post(url, data=data, headers=headers,
+                                timeout=REQUEST_TIMEOUT)
+        if response.status_code == 415 and json_fallback is not None:
+            session.post(url, data=json_fallback,
+                         headers={'Content-Type': "application/json"},
+                         timeout=REQUEST_TIMEOUT)
+    except requests.exceptions.RequestException:
+        pass
 
 
 def announce_new_block(block):
     """
     Funçaõ que anuncia pra rede que um novo bloco foi mineirado.
     """
-    for peer in peers:
-        url = "{}add_block".format(peer)
+    with peers_lock:
+        nodes = list(peers)
+
+    if not nodes:
+        return
+
+    # Serializa o bloco uma única vez e anuncia a todos os pares em
+    # paralelo. A versão JSON acompanha o envio em msgpack para o caso
+    # de algum par não ter msgpack instalado.
+    block_dict = block.to_dict()
+    json_data = _dumps(block_dict)
+    if msgpack is not None:
+        data = msgpack.packb(block_dict)
+        headers = {'Content-Type': "application/msgpack"}
+        json_fallback = json_data
+    else:
+        data = json_data
         headers = {'Content-Type': "application/json"}
-        requests.post(url,
-                      data=json.dumps(block.__dict__, sort_keys=True),
-                      headers=headers)
\ No newline at end of file
+        json_fallback = None
+
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        for peer in nodes:
+            executor.submit(_post_block, peer, data, headers, json_fallback)
\ No newline at end of file